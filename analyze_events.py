@@ -0,0 +1,148 @@
+import argparse
+import json
+import math
+import numpy as np
+from event_log import load_events
+
+METRICS = ["time_to_first_token", "latency", "time_per_output_token", "send_delay"]
+
+def select_window(events, start=None, end=None):
+    # Requests are assigned to a window by their scheduled send time
+    mask = np.ones(len(events), dtype=bool)
+    if start is not None:
+        mask &= events["scheduled_time"] >= start
+    if end is not None:
+        mask &= events["scheduled_time"] < end
+    return events[mask]
+
+def request_metrics(events):
+    ok = events[events["status"] == b"ok"]
+    values = {
+        "time_to_first_token": ok["first_token_time"] - ok["scheduled_time"],
+        "latency": ok["end_time"] - ok["scheduled_time"],
+        "send_delay": ok["send_time"] - ok["scheduled_time"],
+    }
+    # Same definition as the live metric: decode time from the first to the
+    # last token over the tokens that did not arrive with the first chunk
+    decode_tokens = ok["output_tokens"] - ok["first_chunk_tokens"]
+    decoding = ok[(ok["first_chunk_tokens"] >= 0) & (decode_tokens > 0) & (ok["output_chunks"] > 1)]
+    values["time_per_output_token"] = (decoding["last_token_time"] - decoding["first_token_time"]) / (decoding["output_tokens"] - decoding["first_chunk_tokens"])
+    return {name: v[~np.isnan(v)] for name, v in values.items()}
+
+def describe(values, percentiles):
+    summary = {"count": len(values), "average": float(values.mean()) if len(values) else None}
+    for p in percentiles:
+        summary[f"p{p:g}"] = float(np.percentile(values, p)) if len(values) else None
+    return summary
+
+def summarize_events(events, percentiles):
+    duration = float(np.nanmax(events["end_time"]) - np.nanmin(events["scheduled_time"])) if len(events) else 0
+    statuses, counts = np.unique(events["status"], return_counts=True)
+    ok = events[events["status"] == b"ok"]
+    output_tokens = int(ok["output_tokens"][ok["output_tokens"] >= 0].sum())
+    return {
+        "requests": len(events),
+        "status_counts": {status.decode(): int(count) for status, count in zip(statuses, counts)},
+        "duration": duration,
+        "requests_per_second": len(ok) / duration if duration > 0 else 0,
+        "output_tokens_per_second": output_tokens / duration if duration > 0 else 0,
+        **{name: describe(values, percentiles) for name, values in request_metrics(events).items()},
+    }
+
+def mann_whitney_u(a, b):
+    # Two-sided Mann-Whitney U test using the normal approximation with a tie
+    # correction; returns (U, p-value)
+    n1, n2 = len(a), len(b)
+    n = n1 + n2
+    combined = np.concatenate([a, b])
+    order = np.argsort(combined, kind="mergesort")
+    _, first, counts = np.unique(combined[order], return_index=True, return_counts=True)
+    ranks = np.empty(n)
+    ranks[order] = np.repeat(first + (counts + 1) / 2, counts)
+    u = ranks[:n1].sum() - n1 * (n1 + 1) / 2
+    tie_term = float((counts.astype(np.float64) ** 3 - counts).sum())
+    variance = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+    if variance <= 0:
+        return float(u), 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / math.sqrt(variance)
+    return float(u), math.erfc(max(z, 0) / math.sqrt(2))
+
+def bootstrap_difference(a, b, percentile, iterations, rng):
+    # 95% confidence interval for percentile(b) - percentile(a)
+    differences = np.empty(iterations)
+    for i in range(iterations):
+        differences[i] = np.percentile(rng.choice(b, len(b)), percentile) - np.percentile(rng.choice(a, len(a)), percentile)
+    return [float(np.percentile(differences, 2.5)), float(np.percentile(differences, 97.5))]
+
+def compare_events(baseline, candidate, percentiles, iterations, alpha, seed):
+    rng = np.random.default_rng(seed)
+    baseline_metrics = request_metrics(baseline)
+    candidate_metrics = request_metrics(candidate)
+    comparison = {}
+    for name in METRICS:
+        a, b = baseline_metrics[name], candidate_metrics[name]
+        if not len(a) or not len(b):
+            comparison[name] = None
+            continue
+        _, p_value = mann_whitney_u(a, b)
+        entry = {"mann_whitney_p_value": p_value, "significant": p_value < alpha}
+        for p in percentiles:
+            before, after = float(np.percentile(a, p)), float(np.percentile(b, p))
+            entry[f"p{p:g}"] = {
+                "baseline": before,
+                "candidate": after,
+                "change": after - before,
+                "relative_change": (after - before) / before if before else None,
+            }
+            if iterations:
+                entry[f"p{p:g}"]["change_95ci"] = bootstrap_difference(a, b, p, iterations, rng)
+        comparison[name] = entry
+    return comparison
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze and compare per-request event logs written with --event_log")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    summary_parser = subparsers.add_parser("summary", help="Recompute metrics for one run")
+    summary_parser.add_argument("event_log", type=str, help="Event log directory")
+    summary_parser.add_argument("--percentiles", type=float, nargs="+", default=[50, 90, 95, 99, 99.9], help="Percentiles to report (default: 50 90 95 99 99.9)")
+    summary_parser.add_argument("--start", type=float, default=None, help="Only include requests scheduled at or after this many seconds into the run")
+    summary_parser.add_argument("--end", type=float, default=None, help="Only include requests scheduled before this many seconds into the run")
+    summary_parser.add_argument("--window", type=float, default=None, help="Also report metrics for consecutive windows of this many seconds")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare a candidate run against a baseline run")
+    compare_parser.add_argument("baseline", type=str, help="Baseline event log directory")
+    compare_parser.add_argument("candidate", type=str, help="Candidate event log directory")
+    compare_parser.add_argument("--percentiles", type=float, nargs="+", default=[50, 99], help="Percentiles to compare (default: 50 99)")
+    compare_parser.add_argument("--start", type=float, default=None, help="Only include requests scheduled at or after this many seconds into each run")
+    compare_parser.add_argument("--end", type=float, default=None, help="Only include requests scheduled before this many seconds into each run")
+    compare_parser.add_argument("--bootstrap", type=int, default=1000, help="Bootstrap iterations for confidence intervals, 0 to disable (default: 1000)")
+    compare_parser.add_argument("--alpha", type=float, default=0.05, help="Significance level (default: 0.05)")
+    compare_parser.add_argument("--seed", type=int, default=0, help="Random seed for bootstrapping (default: 0)")
+    args = parser.parse_args()
+
+    if args.command == "summary":
+        metadata, events = load_events(args.event_log)
+        events = select_window(events, args.start, args.end)
+        results = {"config": metadata["config"], **summarize_events(events, args.percentiles)}
+        if args.window and len(events):
+            start = args.start if args.start is not None else 0
+            end = float(np.nanmax(events["scheduled_time"]))
+            results["windows"] = [
+                {"start": t, "end": t + args.window, **summarize_events(select_window(events, t, t + args.window), args.percentiles)}
+                for t in np.arange(start, end + args.window, args.window).tolist()
+                if t <= end
+            ]
+    else:
+        baseline_metadata, baseline = load_events(args.baseline)
+        candidate_metadata, candidate = load_events(args.candidate)
+        results = {
+            "baseline": baseline_metadata["config"],
+            "candidate": candidate_metadata["config"],
+            "comparison": compare_events(select_window(baseline, args.start, args.end), select_window(candidate, args.start, args.end), args.percentiles, args.bootstrap, args.alpha, args.seed),
+        }
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
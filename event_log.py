@@ -0,0 +1,91 @@
+import glob
+import json
+import math
+import os
+import struct
+import time
+import numpy as np
+
+# One fixed-size little-endian record per request. Times are seconds since the
+# start of the run (NaN when the event never happened), token counts are -1
+# when unknown and cache is -1/0/1 for none/miss/hit.
+EVENT_LOG_VERSION = 2
+EVENT_DTYPE = np.dtype([
+    ("task_id", "<i8"),
+    ("prompt_id", "S48"),
+    ("status", "S16"),
+    ("scheduled_time", "<f8"),
+    ("send_time", "<f8"),
+    ("first_token_time", "<f8"),
+    ("last_token_time", "<f8"),
+    ("end_time", "<f8"),
+    ("input_tokens", "<i4"),
+    ("output_tokens", "<i4"),
+    ("output_chunks", "<i4"),
+    ("first_chunk_tokens", "<i4"),
+    ("cache", "i1"),
+])
+EVENT_STRUCT = struct.Struct("<q48s16s5d4ib")
+assert EVENT_STRUCT.size == EVENT_DTYPE.itemsize
+
+CACHE_CODES = {None: -1, "miss": 0, "hit": 1}
+
+def write_metadata(directory, config):
+    os.makedirs(directory, exist_ok=True)
+    if glob.glob(os.path.join(directory, "events-*.bin")):
+        raise ValueError(f"{directory} already contains an event log")
+    metadata = {
+        "format": "vllm-benchmark-events",
+        "version": EVENT_LOG_VERSION,
+        "dtype": [list(field) for field in EVENT_DTYPE.descr],
+        "started_at": time.time(),
+        "config": config,
+    }
+    with open(os.path.join(directory, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=2)
+
+class EventLogWriter:
+    # Appends one record per finished request; each load generator process
+    # writes its own file so no locking is needed
+    def __init__(self, directory, shard=0):
+        self.file = open(os.path.join(directory, f"events-{shard}.bin"), "ab")
+        self.start_time = time.perf_counter()
+
+    def relative(self, timestamp):
+        return timestamp - self.start_time if timestamp is not None else math.nan
+
+    def write(self, result):
+        self.file.write(EVENT_STRUCT.pack(
+            result["task_id"],
+            str(result["prompt_id"]).encode()[:48],
+            result["status"].encode()[:16],
+            self.relative(result["scheduled_time"]),
+            self.relative(result["send_time"]),
+            self.relative(result["first_token_time"]),
+            self.relative(result["last_token_time"]),
+            self.relative(result["end_time"]),
+            result["input_tokens"] if result["input_tokens"] is not None else -1,
+            result["output_tokens"] if result["output_tokens"] is not None else -1,
+            result["output_chunks"],
+            result["first_chunk_tokens"] if result["first_chunk_tokens"] is not None else -1,
+            CACHE_CODES[result["cache"]],
+        ))
+
+    def close(self):
+        self.file.close()
+
+def load_events(directory):
+    with open(os.path.join(directory, "metadata.json")) as f:
+        metadata = json.load(f)
+    if metadata.get("version") != EVENT_LOG_VERSION:
+        raise ValueError(f"{directory} has event log version {metadata.get('version')}, expected {EVENT_LOG_VERSION}")
+    paths = sorted(glob.glob(os.path.join(directory, "events-*.bin")))
+    # Memory-map each shard's file; a trailing partial record from an
+    # interrupted run is ignored
+    shards = []
+    for path in paths:
+        count = os.path.getsize(path) // EVENT_DTYPE.itemsize
+        if count:
+            shards.append(np.memmap(path, dtype=EVENT_DTYPE, mode="r", shape=(count,)))
+    events = np.concatenate(shards) if shards else np.empty(0, dtype=EVENT_DTYPE)
+    return metadata, events
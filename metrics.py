@@ -0,0 +1,235 @@
+import math
+from collections import Counter
+import numpy as np
+
+PERCENTILES = [50, 95, 99]
+
+class LatencyHistogram:
+    # Log-bucketed histogram in the style of HDR histograms: every bucket spans
+    # a fixed relative width, so percentiles are accurate to `precision` and the
+    # memory used does not depend on the number of samples.
+    def __init__(self, min_value=1e-6, max_value=1e7, precision=0.01):
+        self.min_value = min_value
+        self.max_value = max_value
+        self.precision = precision
+        self._log_base = math.log1p(precision)
+        self.counts = [0] * (int(math.log(max_value / min_value) / self._log_base) + 2)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _index(self, value):
+        if value <= self.min_value:
+            return 0
+        return min(int(math.log(value / self.min_value) / self._log_base) + 1, len(self.counts) - 1)
+
+    def record(self, value):
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def record_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        scaled = np.maximum(values, self.min_value) / self.min_value
+        indices = np.where(values <= self.min_value, 0, np.log(scaled) / self._log_base + 1).astype(np.int64)
+        np.clip(indices, 0, len(self.counts) - 1, out=indices)
+        for index, count in zip(*np.unique(indices, return_counts=True)):
+            self.counts[index] += int(count)
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other):
+        if (other.min_value, other.max_value, other.precision) != (self.min_value, self.max_value, self.precision):
+            raise ValueError("Cannot merge histograms with different bucket layouts")
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, percentile):
+        if not self.count:
+            return None
+        target = max(1, math.ceil(self.count * percentile / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                break
+        if index == 0:
+            value = self.min_value
+        else:
+            # Geometric midpoint of the bucket
+            value = self.min_value * (1 + self.precision) ** (index - 0.5)
+        return min(max(value, self.min), self.max)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def summary(self, reverse=False):
+        # reverse reports the lower tail, for metrics where higher is better
+        summary = {"average": self.mean()}
+        for p in PERCENTILES:
+            summary[f"p{p}"] = self.percentile(100 - p if reverse else p)
+        return summary
+
+class MetricsAggregator:
+    HISTOGRAMS = ["latency", "tokens_per_second", "ttft", "itl", "tpot", "max_itl", "send_delay", "ttft_cache_hit", "ttft_cache_miss", "time_to_failure"]
+
+    def __init__(self, stall_threshold=0.5, goodput_slos=None):
+        self.stall_threshold = stall_threshold
+        # Per-request limits on "ttft" and "tpot" for goodput, or None
+        self.goodput_slos = goodput_slos
+        self.histograms = {name: LatencyHistogram() for name in self.HISTOGRAMS}
+        self.successful_requests = 0
+        self.failed_requests = 0
+        self.failures = Counter()
+        self.retries = 0
+        self.goodput_requests = 0
+        self.total_input_tokens = 0
+        self.total_output_tokens = 0
+        self.stall_count = 0
+        self.requests_with_stalls = 0
+        self.token_sources = set()
+        self.cached_tokens = 0
+        self.cache_sources = set()
+        self.window = None
+
+    def start_window(self):
+        self.window = MetricsAggregator(self.stall_threshold, self.goodput_slos)
+
+    def take_window(self):
+        # Hand back the samples recorded since the last call and start a new window
+        window = self.window
+        self.start_window()
+        return window
+
+    def meets_goodput_slos(self, result):
+        for name, slo in self.goodput_slos.items():
+            # A single-token response has no inter-token latency to violate
+            if result[name] is None:
+                if name != "tpot":
+                    return False
+            elif result[name] > slo:
+                return False
+        return True
+
+    def record(self, result):
+        if self.window is not None:
+            self.window.record(result)
+        self.retries += result["attempts"] - 1
+        if result["status"] != "ok":
+            self.failed_requests += 1
+            self.failures[result["status"]] += 1
+            self.histograms["time_to_failure"].record(result["latency"])
+            return
+        self.successful_requests += 1
+        if self.goodput_slos and self.meets_goodput_slos(result):
+            self.goodput_requests += 1
+        if result["input_tokens"] is not None:
+            self.total_input_tokens += result["input_tokens"]
+        if result["output_tokens"] is not None:
+            self.total_output_tokens += result["output_tokens"]
+        self.token_sources.add(result["token_source"])
+        for name in ["latency", "tokens_per_second", "ttft", "tpot", "max_itl"]:
+            if result[name] is not None:
+                self.histograms[name].record(result[name])
+        self.histograms["send_delay"].record(result["send_time"] - result["scheduled_time"])
+        if result["cache"] is not None:
+            self.cache_sources.add(result["cache_source"])
+            if result["ttft"] is not None:
+                self.histograms[f"ttft_cache_{result['cache']}"].record(result["ttft"])
+        if result["cached_tokens"]:
+            self.cached_tokens += result["cached_tokens"]
+        self.histograms["itl"].record_many(result["itl"])
+        # A stall is a pause in the stream, so it is measured between chunks
+        stalls = int((result["chunk_gaps"] > self.stall_threshold).sum())
+        self.stall_count += stalls
+        if stalls:
+            self.requests_with_stalls += 1
+
+    def merge(self, other):
+        for name, histogram in self.histograms.items():
+            histogram.merge(other.histograms[name])
+        self.successful_requests += other.successful_requests
+        self.failed_requests += other.failed_requests
+        self.failures += other.failures
+        self.retries += other.retries
+        self.goodput_requests += other.goodput_requests
+        self.total_input_tokens += other.total_input_tokens
+        self.total_output_tokens += other.total_output_tokens
+        self.stall_count += other.stall_count
+        self.requests_with_stalls += other.requests_with_stalls
+        self.token_sources |= other.token_sources
+        self.cached_tokens += other.cached_tokens
+        self.cache_sources |= other.cache_sources
+        return self
+
+    def prefix_cache_summary(self):
+        hit = self.histograms["ttft_cache_hit"]
+        miss = self.histograms["ttft_cache_miss"]
+        if not hit.count and not miss.count:
+            return None
+        ttft_saving = miss.percentile(50) - hit.percentile(50) if hit.count and miss.count else None
+        return {
+            "classified_by": sorted(self.cache_sources),
+            "hit_requests": hit.count,
+            "miss_requests": miss.count,
+            "cached_prompt_tokens": self.cached_tokens,
+            "time_to_first_token_hit": hit.summary(),
+            "time_to_first_token_miss": miss.summary(),
+            "p50_ttft_saving": ttft_saving
+        }
+
+    def goodput_summary(self, elapsed_time):
+        if not self.goodput_slos:
+            return None
+        names = {"ttft": "time_to_first_token", "tpot": "inter_token_latency"}
+        total_requests = self.successful_requests + self.failed_requests
+        return {
+            "slos": {names[name]: slo for name, slo in self.goodput_slos.items()},
+            "requests": self.goodput_requests,
+            "requests_per_second": self.goodput_requests / elapsed_time if elapsed_time > 0 else 0,
+            "fraction": self.goodput_requests / total_requests if total_requests else 0
+        }
+
+    def summary(self, elapsed_time):
+        return {
+            "successful_requests": self.successful_requests,
+            "failed_requests": self.failed_requests,
+            "failures": dict(sorted(self.failures.items())),
+            "retries": self.retries,
+            "time_to_failure": self.histograms["time_to_failure"].summary(),
+            "requests_per_second": self.successful_requests / elapsed_time if elapsed_time > 0 else 0,
+            "goodput": self.goodput_summary(elapsed_time),
+            "total_input_tokens": self.total_input_tokens,
+            "total_output_tokens": self.total_output_tokens,
+            "input_tokens_per_second": self.total_input_tokens / elapsed_time if elapsed_time > 0 else 0,
+            "output_tokens_per_second": self.total_output_tokens / elapsed_time if elapsed_time > 0 else 0,
+            "token_count_source": sorted(self.token_sources),
+            "latency": self.histograms["latency"].summary(),
+            "tokens_per_second": self.histograms["tokens_per_second"].summary(reverse=True),
+            "time_to_first_token": self.histograms["ttft"].summary(),
+            "inter_token_latency": self.histograms["itl"].summary(),
+            "time_per_output_token": self.histograms["tpot"].summary(),
+            "max_inter_token_latency": self.histograms["max_itl"].summary(),
+            "decode_stalls": {
+                "threshold": self.stall_threshold,
+                "count": self.stall_count,
+                "requests_with_stalls": self.requests_with_stalls
+            },
+            "send_delay": self.histograms["send_delay"].summary(),
+            "prefix_cache": self.prefix_cache_summary()
+        }
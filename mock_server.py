@@ -0,0 +1,118 @@
+import asyncio
+import argparse
+import json
+import logging
+import multiprocessing
+import random
+import time
+from workload import Distribution
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+class MockLLM:
+    # Latency model for a streaming chat completions endpoint. Up to
+    # max_batch_size requests generate at once and the rest queue; every
+    # token's delay is scaled by batch_slowdown for each other running request.
+    def __init__(self, ttft="fixed:0.05", token_delay="fixed:0.01", tokens_per_chunk=1, max_batch_size=256, batch_slowdown=0.0, error_rate=0.0, disconnect_rate=0.0, seed=None):
+        self.ttft = Distribution(ttft)
+        self.token_delay = Distribution(token_delay)
+        self.tokens_per_chunk = tokens_per_chunk
+        self.batch_slots = asyncio.Semaphore(max_batch_size)
+        self.batch_slowdown = batch_slowdown
+        self.error_rate = error_rate
+        self.disconnect_rate = disconnect_rate
+        self.rng = random.Random(seed)
+        self.running = 0
+
+    def chunk(self, delta, finish_reason=None):
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "mock",
+            "choices": [{"index": 0, "delta": delta, "logprobs": None, "finish_reason": finish_reason}]
+        }
+
+    async def send(self, response, event):
+        await response.write(b"data: " + json.dumps(event).encode() + b"\n\n")
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        if not body.get("stream"):
+            return web.json_response({"error": {"message": "Only streaming requests are supported"}}, status=400)
+        if self.rng.random() < self.error_rate:
+            return web.json_response({"error": {"message": "Injected error"}}, status=500)
+
+        max_tokens = body.get("max_tokens") or 16
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+        disconnect_at = self.rng.randrange(max_tokens) if self.rng.random() < self.disconnect_rate else None
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        async with self.batch_slots:
+            self.running += 1
+            try:
+                await self.send(response, self.chunk({"role": "assistant", "content": ""}))
+                # Sleep until absolute deadlines so that timer and event loop
+                # overhead do not accumulate into the delays the client sees
+                deadline = time.perf_counter() + self.ttft(self.rng)
+                await asyncio.sleep(deadline - time.perf_counter())
+                for sent in range(0, max_tokens, self.tokens_per_chunk):
+                    if sent:
+                        slowdown = 1 + self.batch_slowdown * (self.running - 1)
+                        deadline += self.token_delay(self.rng) * slowdown
+                        await asyncio.sleep(deadline - time.perf_counter())
+                    if disconnect_at is not None and sent >= disconnect_at:
+                        request.transport.close()
+                        return response
+                    count = min(self.tokens_per_chunk, max_tokens - sent)
+                    finish_reason = "length" if sent + count >= max_tokens else None
+                    await self.send(response, self.chunk({"content": " token" * count}, finish_reason))
+            finally:
+                self.running -= 1
+
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": max_tokens, "total_tokens": prompt_tokens + max_tokens}
+            await self.send(response, {**self.chunk({}), "choices": [], "usage": usage})
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+def create_app(*args, **kwargs):
+    if web is None:
+        raise ImportError("The aiohttp package is required for the mock server (pip install aiohttp)")
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", MockLLM(*args, **kwargs).chat_completions)
+    return app
+
+def serve(args):
+    app = create_app(args.ttft, args.token_delay, args.tokens_per_chunk, args.max_batch_size, args.batch_slowdown, args.error_rate, args.disconnect_rate, args.seed)
+    web.run_app(app, host=args.host, port=args.port, access_log=None, reuse_port=args.workers > 1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible streaming mock server with a configurable latency model")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on (default: 8000)")
+    parser.add_argument("--ttft", type=str, default="fixed:0.05", help="Time to first token distribution in seconds (default: fixed:0.05)")
+    parser.add_argument("--token_delay", type=str, default="fixed:0.01", help="Delay between chunks distribution in seconds (default: fixed:0.01)")
+    parser.add_argument("--tokens_per_chunk", type=int, default=1, help="Tokens sent in each streamed chunk (default: 1)")
+    parser.add_argument("--max_batch_size", type=int, default=256, help="Requests generating at once; the rest wait in a queue (default: 256)")
+    parser.add_argument("--batch_slowdown", type=float, default=0.0, help="Relative token delay increase per additional running request (default: 0)")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500 (default: 0)")
+    parser.add_argument("--disconnect_rate", type=float, default=0.0, help="Fraction of requests whose connection is dropped mid-stream (default: 0)")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for the latency model")
+    parser.add_argument("--workers", type=int, default=1, help="Server processes sharing the port; batch size and rates apply per process (default: 1)")
+    args = parser.parse_args()
+
+    # Extra workers bind the same port with SO_REUSEPORT and the kernel spreads
+    # connections between them; they exit together with this process
+    workers = [multiprocessing.Process(target=serve, args=(args,), daemon=True) for _ in range(args.workers - 1)]
+    for worker in workers:
+        worker.start()
+    serve(args)
@@ -22,13 +22,109 @@ async def run_all_benchmarks(vllm_url, api_key, use_long_context):
 
     return all_results
 
+def meets_slo(results, slos):
+    # Failed requests have no latency to check, so any failure is a violation
+    if results["failed_requests"]:
+        return False
+    for metric, threshold in slos.items():
+        value = results[metric]["p99"]
+        if value is None or value > threshold:
+            return False
+    return True
+
+async def run_sweep_step(mode, value, vllm_url, api_key, use_long_context, output_tokens, step_multiplier, max_concurrency, benchmark_options):
+    if mode == "qps":
+        num_requests = max(1, int(value * step_multiplier))
+        return await run_benchmark(num_requests, max_concurrency, 30, output_tokens, vllm_url, api_key, use_long_context, qps=value, **benchmark_options)
+    return await run_benchmark(value * step_multiplier, value, 30, output_tokens, vllm_url, api_key, use_long_context, **benchmark_options)
+
+async def find_saturation(vllm_url, api_key, use_long_context, mode, slos, start, max_value, tolerance, output_tokens=100, step_multiplier=10, max_concurrency=1000, cooldown=5, benchmark_options=None):
+    curve = []
+
+    async def measure(value):
+        print(f"Running sweep step with {mode} {value}...")
+        results = await run_sweep_step(mode, value, vllm_url, api_key, use_long_context, output_tokens, step_multiplier, max_concurrency, benchmark_options or {})
+        passed = meets_slo(results, slos)
+        curve.append({
+            mode: value,
+            "meets_slo": passed,
+            "requests_per_second": results["requests_per_second"],
+            "output_tokens_per_second": results["total_output_tokens"] / results["total_time"] if results["total_time"] > 0 else 0,
+            **{f"{metric}_p99": results[metric]["p99"] for metric in slos},
+            "results": results,
+        })
+        await asyncio.sleep(cooldown)
+        return passed
+
+    # Ramp up geometrically until the SLO breaks, then bisect the last interval
+    good, bad = None, None
+    value = start
+    while True:
+        if await measure(value):
+            good = value
+            if value >= max_value:
+                break
+            value = min(value * 2, max_value)
+        else:
+            bad = value
+            break
+
+    if good is not None and bad is not None:
+        while bad - good > max(1 if mode == "concurrency" else 0, good * tolerance):
+            mid = (good + bad) // 2 if mode == "concurrency" else (good + bad) / 2
+            if await measure(mid):
+                good = mid
+            else:
+                bad = mid
+
+    curve.sort(key=lambda point: point[mode])
+    knee = next((point for point in curve if point[mode] == good), None)
+    return {
+        "mode": mode,
+        "slos": slos,
+        "max_sustainable": good,
+        "first_violation": bad,
+        "knee": knee,
+        "curve": curve,
+    }
+
 def main():
     parser = argparse.ArgumentParser(description="Run vLLM benchmarks with various configurations")
     parser.add_argument("--vllm_url", type=str, required=True, help="URL of the vLLM server")
     parser.add_argument("--api_key", type=str, required=True, help="API key for vLLM server")
     parser.add_argument("--use_long_context", action="store_true", help="Use long context prompt pairs instead of short prompts")
+    parser.add_argument("--sweep", type=str, default=None, choices=["concurrency", "qps"], help="Search for the highest concurrency or QPS that meets the SLOs instead of running fixed configurations")
+    parser.add_argument("--ttft_slo", type=float, default=None, help="p99 time to first token SLO in seconds")
+    parser.add_argument("--itl_slo", type=float, default=None, help="p99 inter-token latency SLO in seconds")
+    parser.add_argument("--latency_slo", type=float, default=None, help="p99 end-to-end latency SLO in seconds")
+    parser.add_argument("--sweep_start", type=float, default=1, help="Starting concurrency or QPS for the sweep (default: 1)")
+    parser.add_argument("--sweep_max", type=float, default=1024, help="Upper bound for the sweep (default: 1024)")
+    parser.add_argument("--sweep_tolerance", type=float, default=0.05, help="Stop bisecting once the search interval is within this fraction (default: 0.05)")
+    parser.add_argument("--step_multiplier", type=int, default=10, help="Requests per sweep step as a multiple of the concurrency or QPS level (default: 10)")
     args = parser.parse_args()
 
+    if args.sweep:
+        slos = {}
+        if args.ttft_slo is not None:
+            slos["time_to_first_token"] = args.ttft_slo
+        if args.itl_slo is not None:
+            slos["inter_token_latency"] = args.itl_slo
+        if args.latency_slo is not None:
+            slos["latency"] = args.latency_slo
+        if not slos:
+            parser.error("--sweep requires at least one SLO")
+        start, max_value = args.sweep_start, args.sweep_max
+        if args.sweep == "concurrency":
+            start, max_value = int(start), int(max_value)
+        sweep_results = asyncio.run(find_saturation(args.vllm_url, args.api_key, args.use_long_context, args.sweep, slos, start, max_value, args.sweep_tolerance, step_multiplier=args.step_multiplier))
+
+        with open('sweep_results.json', 'w') as f:
+            json.dump(sweep_results, f, indent=2)
+
+        print(f"Max sustainable {args.sweep}: {sweep_results['max_sustainable']}")
+        print("Sweep results saved to sweep_results.json")
+        return
+
     all_results = asyncio.run(run_all_benchmarks(args.vllm_url, args.api_key, args.use_long_context))
 
     with open('benchmark_results.json', 'w') as f:
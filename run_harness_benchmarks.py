@@ -0,0 +1,160 @@
+import asyncio
+import argparse
+import contextlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import numpy as np
+from vllm_benchmark import run_benchmark, calibrate_client_overhead
+from run_benchmarks import find_saturation
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+MOCK_TTFT = 0.1
+MOCK_TOKEN_DELAY = 0.01
+MOCK_OUTPUT_TOKENS = 20
+MOCK_QPS = 60
+MOCK_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_server.py")
+
+@contextlib.contextmanager
+def mock_server(*args):
+    # Run the mock server in its own process so it does not share the
+    # client's event loop or CPU time
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen([sys.executable, MOCK_SERVER, "--port", str(port), *args], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline or process.poll() is not None:
+                    raise RuntimeError("Mock server did not start")
+                time.sleep(0.1)
+        yield f"http://127.0.0.1:{port}/v1"
+    finally:
+        process.terminate()
+        process.wait()
+
+def check(name, passed, **values):
+    print(f"{'PASS' if passed else 'FAIL'} {name}: " + ", ".join(f"{k}={v}" for k, v in values.items()))
+    return {"name": name, "passed": passed, **values}
+
+def check_accuracy(name, results, expected, tolerance, p99_tolerance):
+    # The mock's delays are fixed, so any spread in the measurement is error
+    p50, p99 = results["p50"], results["p99"]
+    return [
+        check(f"{name}_p50_accuracy", p50 is not None and abs(p50 - expected) <= tolerance, expected=expected, measured=p50, tolerance=tolerance),
+        check(f"{name}_p99_accuracy", p99 is not None and abs(p99 - expected) <= p99_tolerance, expected=expected, measured=p99, tolerance=p99_tolerance),
+    ]
+
+async def check_metric_accuracy(transport, ttft_tolerance, itl_tolerance, p99_tolerance):
+    num_requests = 500
+    with mock_server("--ttft", f"fixed:{MOCK_TTFT}", "--token_delay", f"fixed:{MOCK_TOKEN_DELAY}") as url:
+        # Constant arrivals keep about 20 requests in flight without the burst
+        # of simultaneous connection setups a closed-loop start would cause
+        results = await run_benchmark(num_requests, 100, 30, MOCK_OUTPUT_TOKENS, url, "mock", False, qps=MOCK_QPS, arrival_distribution="constant", report_interval=0, transport=transport)
+    return [
+        check("completed_requests", results["successful_requests"] == num_requests, expected=num_requests, measured=results["successful_requests"]),
+        check("output_tokens", results["total_output_tokens"] == num_requests * MOCK_OUTPUT_TOKENS, expected=num_requests * MOCK_OUTPUT_TOKENS, measured=results["total_output_tokens"]),
+        *check_accuracy("ttft", results["time_to_first_token"], MOCK_TTFT, ttft_tolerance, p99_tolerance),
+        *check_accuracy("itl", results["inter_token_latency"], MOCK_TOKEN_DELAY, itl_tolerance, p99_tolerance),
+    ]
+
+async def check_failure_accounting(transport):
+    # Injected errors, dropped streams and timeouts must all be counted and
+    # classified rather than dropped from the results
+    num_requests = 200
+    with mock_server("--ttft", "uniform:0:1.5", "--error_rate", "0.1", "--disconnect_rate", "0.1", "--seed", "0") as url:
+        results = await run_benchmark(num_requests, 20, 1, MOCK_OUTPUT_TOKENS, url, "mock", False, report_interval=0, transport=transport)
+    failures = results["failures"]
+    accounted = results["successful_requests"] + results["failed_requests"]
+    return [
+        check("requests_accounted", accounted == num_requests, expected=num_requests, measured=accounted),
+        check("failures_classified", set(failures) == {"http_500", "disconnect", "timeout_ttft", "timeout_decode"}, measured=failures),
+    ]
+
+async def check_client_overhead(transport, max_chunk_overhead):
+    overhead = await calibrate_client_overhead(transport)
+    return [check("client_overhead_per_chunk", overhead <= max_chunk_overhead, measured=overhead, limit=max_chunk_overhead)]
+
+async def raw_stream(session, url, gaps):
+    # Reads the event stream without decoding it: about the least work any
+    # client can do per chunk
+    payload = {"model": "mock", "messages": [{"role": "user", "content": "capacity"}], "max_tokens": MOCK_OUTPUT_TOKENS, "stream": True}
+    async with session.post(url + "/chat/completions", json=payload) as response:
+        times = [time.perf_counter() async for line in response.content if line.startswith(b"data:")]
+    # Skip the role chunk and the trailing [DONE] event
+    gaps.extend(np.diff(times[1:-1]).tolist())
+
+async def measure_mock_capacity(url, itl_slo, max_concurrency):
+    # Highest concurrency (doubling from 16) at which the mock and this machine
+    # still meet the ITL SLO when streams are read by a raw consumer. The
+    # client cannot be expected to do better than that.
+    capacity = 0
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        concurrency = 16
+        while concurrency <= max_concurrency:
+            gaps = []
+            await asyncio.gather(*[raw_stream(session, url, gaps) for _ in range(concurrency * 2)])
+            if np.percentile(gaps, 99) > itl_slo:
+                break
+            capacity = concurrency
+            concurrency *= 2
+    return capacity
+
+async def check_max_concurrency(transport, itl_budget, min_concurrency, max_concurrency, min_capacity_fraction, mock_workers):
+    # The mock is configured without batch slowdown, so ITL inflation as
+    # concurrency rises means the client, the mock or the machine is falling
+    # behind. Measuring the mock with a raw consumer first separates the client
+    # from the rest.
+    slos = {"inter_token_latency": MOCK_TOKEN_DELAY + itl_budget}
+    with mock_server("--ttft", "fixed:0.01", "--token_delay", f"fixed:{MOCK_TOKEN_DELAY}", "--max_batch_size", str(max_concurrency), "--workers", str(mock_workers)) as url:
+        capacity = await measure_mock_capacity(url, slos["inter_token_latency"], max_concurrency)
+        required = min(min_concurrency, int(capacity * min_capacity_fraction))
+        sweep = await find_saturation(url, "mock", False, "concurrency", slos, 16, max(16, min(max_concurrency, capacity)), 0.1, output_tokens=MOCK_OUTPUT_TOKENS, step_multiplier=2, cooldown=0, benchmark_options={"report_interval": 0, "transport": transport})
+    achieved = sweep["max_sustainable"] or 0
+    return [check("max_concurrency", achieved >= required and required > 0, measured=achieved, required=required, minimum=min_concurrency, mock_capacity=capacity, itl_slo=slos["inter_token_latency"])]
+
+async def run_harness_benchmarks(args):
+    checks = []
+    checks += await check_metric_accuracy(args.transport, args.ttft_tolerance, args.itl_tolerance, args.p99_tolerance)
+    checks += await check_failure_accounting(args.transport)
+    checks += await check_client_overhead(args.transport, args.max_chunk_overhead)
+    checks += await check_max_concurrency(args.transport, args.itl_budget, args.min_concurrency, args.max_concurrency, args.min_capacity_fraction, args.mock_workers)
+    return checks
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the benchmark client itself against the bundled mock server")
+    parser.add_argument("--transport", type=str, default="http", choices=["openai", "http"], help="Client transport to test; the default budgets are set for http (default: http)")
+    parser.add_argument("--ttft_tolerance", type=float, default=0.005, help="Allowed error in measured p50 TTFT in seconds (default: 0.005)")
+    parser.add_argument("--itl_tolerance", type=float, default=0.001, help="Allowed error in measured p50 ITL in seconds (default: 0.001)")
+    parser.add_argument("--p99_tolerance", type=float, default=0.01, help="Allowed error in measured p99 TTFT and ITL in seconds (default: 0.01)")
+    parser.add_argument("--max_chunk_overhead", type=float, default=5e-5, help="Maximum client receive-to-yield time per chunk in seconds (default: 0.00005)")
+    parser.add_argument("--itl_budget", type=float, default=0.01, help="p99 ITL inflation allowed before the client counts as saturated, in seconds (default: 0.01)")
+    parser.add_argument("--min_concurrency", type=int, default=256, help="Minimum concurrency the client must sustain (default: 256)")
+    parser.add_argument("--max_concurrency", type=int, default=2048, help="Upper bound for the concurrency search (default: 2048)")
+    parser.add_argument("--min_capacity_fraction", type=float, default=0.5, help="When the mock itself saturates below --min_concurrency, the client must sustain this fraction of the mock's capacity instead (default: 0.5)")
+    parser.add_argument("--mock_workers", type=int, default=os.cpu_count() or 1, help="Mock server processes for the concurrency check (default: number of CPUs)")
+    args = parser.parse_args()
+
+    checks = asyncio.run(run_harness_benchmarks(args))
+
+    with open('harness_results.json', 'w') as f:
+        json.dump(checks, f, indent=2)
+
+    failed = [c["name"] for c in checks if not c["passed"]]
+    print(f"{len(checks) - len(failed)}/{len(checks)} checks passed, results saved to harness_results.json")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import json
+import time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Errors raised when the connection is refused or dropped mid-stream
+CONNECTION_ERRORS = (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError) if aiohttp else ()
+
+class SSEClient:
+    # Minimal OpenAI-compatible streaming client: one pooled keep-alive
+    # session, and chunks are decoded straight from the SSE lines without
+    # building response objects
+    def __init__(self, base_url, api_key):
+        if aiohttp is None:
+            raise ImportError("The aiohttp package is required for --transport http (pip install aiohttp)")
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=None)
+        )
+
+    async def stream_chat(self, payload, token_times, first_token=None):
+        async with self.session.post(self.url, json={**payload, "stream": True}, headers=self.headers) as response:
+            try:
+                response.raise_for_status()
+                return await read_events(response.content, token_times, first_token)
+            except BaseException:
+                # Drop the connection rather than returning it to the pool, so
+                # the server aborts a generation we are no longer reading
+                response.close()
+                raise
+
+    async def close(self):
+        await self.session.close()
+
+def parse_event(line):
+    # Returns (content, finish_reason, usage, done) for one line of the event stream
+    if not line.startswith(b"data:"):
+        return None, None, None, False
+    data = line[5:].strip()
+    if data == b"[DONE]":
+        return None, None, None, True
+    event = json.loads(data)
+    choices = event.get("choices")
+    if not choices:
+        return None, None, event.get("usage"), False
+    return choices[0].get("delta", {}).get("content"), choices[0].get("finish_reason"), event.get("usage"), False
+
+async def read_events(lines, token_times, first_token=None):
+    # Chunk arrival times are appended to token_times as they come in, so the
+    # caller still has them if the stream is cancelled part way. The optional
+    # first_token event is set when the first token arrives.
+    text_chunks = []
+    usage = None
+    finished = False
+    async for line in lines:
+        content, finish_reason, chunk_usage, done = parse_event(line)
+        if done:
+            break
+        if chunk_usage is not None:
+            usage = chunk_usage
+        if content:
+            token_times.append(time.perf_counter())
+            text_chunks.append(content)
+            if first_token is not None and len(token_times) == 1:
+                first_token.set()
+        if finish_reason:
+            finished = True
+    return text_chunks, usage, finished
@@ -1,14 +1,27 @@
 import asyncio
 import time
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from array import array
 import numpy as np
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError
 import logging
 import argparse
 import json
 import random
+from metrics import MetricsAggregator
+from sse_client import SSEClient, CONNECTION_ERRORS
+from workload import Workload, LengthDistribution, sample_dataset
+from event_log import EventLogWriter, write_metadata
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# The openai SDK's HTTP client logs every request at INFO, which costs client
+# CPU time at high request rates
+for name in ["httpx", "httpx2"]:
+    logging.getLogger(name).setLevel(logging.WARNING)
 
 SHORT_PROMPTS = [
     "Explain the concept of artificial intelligence in simple terms.",
@@ -106,145 +119,628 @@ LONG_PROMPT_PAIRS = [
     },
 ]
 
-async def process_stream(stream):
-    first_token_time = None
-    total_tokens = 0
+@functools.lru_cache(maxsize=None)
+def load_tokenizer(path):
+    try:
+        from tokenizers import Tokenizer
+    except ImportError:
+        raise ImportError("The tokenizers package is required for --tokenizer (pip install tokenizers)")
+    return Tokenizer.from_file(path)
+
+def count_tokens(tokenizer, text):
+    return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+def chunk_token_counts(text_chunks, total_tokens, tokenizer=None):
+    # Tokens carried by each streamed chunk. Servers may send several tokens
+    # per chunk; without a tokenizer the total is spread evenly over chunks.
+    num_chunks = len(text_chunks)
+    if total_tokens == num_chunks:
+        return np.ones(num_chunks, dtype=np.int64)
+    if tokenizer is not None:
+        counts = np.array([count_tokens(tokenizer, text) for text in text_chunks], dtype=np.int64)
+    else:
+        counts = np.full(num_chunks, total_tokens // num_chunks if num_chunks else 0, dtype=np.int64)
+        counts[:total_tokens % num_chunks if num_chunks else 0] += 1
+    return np.maximum(counts, 1)
+
+async def process_stream(stream, token_times, first_token=None):
+    # Arrival time of every content chunk is appended to token_times, a flat
+    # double array owned by the caller so it survives cancellation. The
+    # optional first_token event is set when the first token arrives.
+    text_chunks = []
+    usage = None
+    finished = False
+    # Keep reading past finish_reason: the usage chunk is sent after it
     async for chunk in stream:
-        if first_token_time is None:
-            first_token_time = time.time()
-        if chunk.choices[0].delta.content:
-            total_tokens += 1
-        if chunk.choices[0].finish_reason is not None:
-            break
-    return first_token_time, total_tokens
+        if chunk.usage is not None:
+            usage = chunk.usage.model_dump()
+        if not chunk.choices:
+            continue
+        content = chunk.choices[0].delta.content
+        if content:
+            token_times.append(time.perf_counter())
+            text_chunks.append(content)
+            if first_token is not None and len(token_times) == 1:
+                first_token.set()
+        if chunk.choices[0].finish_reason:
+            finished = True
+    return text_chunks, usage, finished
+
+async def stream_openai(client, payload, token_times, first_token=None):
+    stream = await client.chat.completions.create(**payload, stream=True)
+    try:
+        return await process_stream(stream, token_times, first_token)
+    finally:
+        # Closing the response on timeout or error makes the server abort the
+        # generation instead of finishing it for nobody
+        await stream.close()
 
-async def make_request(client, output_tokens, request_timeout, use_long_context):
-    start_time = time.time()
+def builtin_records(use_long_context):
     if use_long_context:
-        prompt_pair = random.choice(LONG_PROMPT_PAIRS)
-        content = prompt_pair["context"] + "\n\n" + prompt_pair["prompt"]
+        prompts = [pair["context"] + "\n\n" + pair["prompt"] for pair in LONG_PROMPT_PAIRS]
     else:
-        content = random.choice(SHORT_PROMPTS)
+        prompts = SHORT_PROMPTS
+    return [{"messages": [{"role": "user", "content": prompt}], "output_tokens": None, "prompt_id": i} for i, prompt in enumerate(prompts)]
 
-    try:
-        stream = await client.chat.completions.create(
-            model="NousResearch/Meta-Llama-3.1-8B-Instruct",
-            messages=[
-                {"role": "user", "content": content}
-            ],
-            max_tokens=output_tokens,
-            stream=True
-        )
-        first_token_time, total_tokens = await asyncio.wait_for(process_stream(stream), timeout=request_timeout)
-        
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        ttft = first_token_time - start_time if first_token_time else None
-        tokens_per_second = total_tokens / elapsed_time if elapsed_time > 0 else 0
-        return total_tokens, elapsed_time, tokens_per_second, ttft
+def classify_error(error):
+    # Failure class recorded in the results and the event log
+    if isinstance(error, APIStatusError):
+        return f"http_{error.status_code}"
+    status = getattr(error, "status", None)
+    if isinstance(status, int):
+        # aiohttp.ClientResponseError from the http transport
+        return f"http_{status}"
+    if isinstance(error, (APIConnectionError, ConnectionError, *CONNECTION_ERRORS)):
+        return "disconnect"
+    return "error"
+
+class RetryPolicy:
+    # Retries failures that are likely transient (HTTP 429 and 5xx, dropped
+    # connections) with exponential backoff. Timeouts are not retried: the
+    # request has already used its whole time budget.
+    def __init__(self, max_retries=0, backoff=0.5):
+        self.max_retries = max_retries
+        self.backoff = backoff
 
+    def should_retry(self, status, attempts):
+        if attempts > self.max_retries:
+            return False
+        if status == "disconnect":
+            return True
+        if status.startswith("http_"):
+            code = int(status[5:])
+            return code == 429 or code >= 500
+        return False
+
+    def delay(self, attempts):
+        return self.backoff * 2 ** (attempts - 1)
+
+async def send_request(client, payload, request_timeout, token_times, first_token=None):
+    # One attempt; returns (status, text_chunks, usage)
+    try:
+        if isinstance(client, SSEClient):
+            text_chunks, usage, finished = await asyncio.wait_for(client.stream_chat(payload, token_times, first_token), timeout=request_timeout)
+        else:
+            text_chunks, usage, finished = await asyncio.wait_for(stream_openai(client, payload, token_times, first_token), timeout=request_timeout)
     except asyncio.TimeoutError:
-        logging.warning(f"Request timed out after {request_timeout} seconds")
-        return None
+        return ("timeout_decode" if token_times else "timeout_ttft"), None, None
     except Exception as e:
-        logging.error(f"Error during request: {str(e)}")
-        return None
+        status = classify_error(e)
+        if status == "error":
+            logging.error(f"Error during request: {str(e)}")
+        return status, None, None
+    # A stream that ends without a finish_reason was cut off by the server
+    return ("ok" if finished else "disconnect"), text_chunks, usage
+
+class PrefixGroup:
+    def __init__(self, members):
+        self.first_token = [asyncio.Event() for _ in range(members)]
+        self.failed = [False] * members
+        self.remaining = members
+
+class PrefixGate:
+    # A request can only hit the prefix cache once the request that shares
+    # its prefix has been prefilled. This holds each request back until that
+    # request has received its first token: the group's first request in
+    # shared mode, or the previous turn in multi_turn mode.
+    def __init__(self, workload, num_requests):
+        self.workload = workload
+        self.num_requests = num_requests
+        self.groups = {}
+
+    async def enter(self, task_id):
+        # Returns (group, position, released), where released is False if the
+        # request waited for a request that failed before its first token
+        group, position = self.workload.prefix_group(task_id)
+        if group not in self.groups:
+            group_size = self.workload.prefix_group_size
+            self.groups[group] = PrefixGroup(min(group_size, self.num_requests - group * group_size))
+        prefix_group = self.groups[group]
+        if position == 0:
+            return prefix_group, position, True
+        previous = 0 if self.workload.prefix_mode == "shared" else position - 1
+        await prefix_group.first_token[previous].wait()
+        return prefix_group, position, not prefix_group.failed[previous]
+
+    def leave(self, task_id, prefix_group, position):
+        # Release the requests waiting on this one, even if it failed
+        if not prefix_group.first_token[position].is_set():
+            prefix_group.failed[position] = True
+            prefix_group.first_token[position].set()
+        prefix_group.remaining -= 1
+        if not prefix_group.remaining:
+            del self.groups[self.workload.prefix_group(task_id)[0]]
+
+async def make_request(client, workload, task_id, request_timeout, scheduled_time=None, tokenizer=None, retry_policy=None, prefix_gate=None):
+    messages, output_tokens, prompt_id, expected_cache = workload.get(task_id)
+    first_token = None
+    if prefix_gate is not None:
+        prefix_group, position, released = await prefix_gate.enter(task_id)
+        first_token = prefix_group.first_token[position]
+        if position:
+            # The request could not have been sent before its prefix was
+            # cached, so it counts as scheduled at its release
+            if scheduled_time is not None:
+                scheduled_time = max(scheduled_time, time.perf_counter())
+            if not released:
+                expected_cache = None
+    start_time = time.perf_counter()
+    if scheduled_time is None:
+        scheduled_time = start_time
+
+    payload = {
+        "model": "NousResearch/Meta-Llama-3.1-8B-Instruct",
+        "messages": messages,
+        "max_tokens": output_tokens,
+        "stream_options": {"include_usage": True}
+    }
 
-async def worker(client, semaphore, queue, results, output_tokens, request_timeout, use_long_context):
+    attempts = 0
     while True:
+        attempts += 1
+        token_times = array('d')
+        status, text_chunks, usage = await send_request(client, payload, request_timeout, token_times, first_token)
+        if status == "ok" or retry_policy is None or not retry_policy.should_retry(status, attempts):
+            break
+        logging.debug(f"Retrying request {task_id} after {status}")
+        await asyncio.sleep(retry_policy.delay(attempts))
+    if prefix_gate is not None:
+        prefix_gate.leave(task_id, prefix_group, position)
+
+    end_time = time.perf_counter()
+    first_token_time = token_times[0] if token_times else None
+    last_token_time = token_times[-1] if token_times else None
+    if status != "ok":
+        logging.warning(f"Request {task_id} failed: {status}" + (f" after {attempts} attempts" if attempts > 1 else ""))
+        return {
+            "task_id": task_id,
+            "prompt_id": prompt_id,
+            "status": status,
+            "attempts": attempts,
+            "input_tokens": None,
+            "output_tokens": None,
+            "output_chunks": len(token_times),
+            "first_chunk_tokens": None,
+            "cache": expected_cache,
+            "latency": end_time - scheduled_time,
+            "scheduled_time": scheduled_time,
+            "send_time": start_time,
+            "first_token_time": first_token_time,
+            "last_token_time": last_token_time,
+            "end_time": end_time,
+        }
+
+    # A chunk may carry several tokens, so prefer the server's own count
+    if usage is not None:
+        prompt_tokens, total_tokens, token_source = usage["prompt_tokens"], usage["completion_tokens"], "usage"
+    elif tokenizer is not None:
+        prompt_tokens, total_tokens, token_source = count_tokens(tokenizer, "\n".join(m["content"] for m in messages)), count_tokens(tokenizer, "".join(text_chunks)), "tokenizer"
+    else:
+        prompt_tokens, total_tokens, token_source = None, len(token_times), "chunks"
+    # Prefer the server's report of prefix-cached prompt tokens (vLLM
+    # needs --enable-prompt-tokens-details) over the workload's expectation
+    cached_tokens = ((usage or {}).get("prompt_tokens_details") or {}).get("cached_tokens")
+    if cached_tokens is not None and expected_cache is not None:
+        cache, cache_source = ("hit" if cached_tokens > 0 else "miss"), "server"
+    else:
+        cache, cache_source = expected_cache, "expected"
+    # Latency and TTFT are measured from the scheduled send time so that
+    # client-side queueing in open-loop mode is not hidden
+    elapsed_time = end_time - scheduled_time
+    ttft = first_token_time - scheduled_time if first_token_time else None
+    stream_time = end_time - start_time
+    tokens_per_second = total_tokens / stream_time if stream_time > 0 else 0
+    # Gaps between chunks, as seen by the user, are split evenly over the
+    # tokens each chunk carried so that ITL is per token
+    chunk_gaps = np.diff(np.frombuffer(token_times, dtype=np.float64))
+    chunk_tokens = chunk_token_counts(text_chunks, total_tokens, tokenizer)
+    itl = np.repeat(chunk_gaps / chunk_tokens[1:], chunk_tokens[1:])
+    # Decode time per token, excluding the prefill that TTFT covers and the
+    # tokens that arrived with the first chunk
+    first_chunk_tokens = int(chunk_tokens[0]) if len(chunk_tokens) else None
+    decode_tokens = total_tokens - first_chunk_tokens if first_chunk_tokens is not None else 0
+    tpot = (last_token_time - first_token_time) / decode_tokens if decode_tokens > 0 and len(token_times) > 1 else None
+    return {
+        "task_id": task_id,
+        "prompt_id": prompt_id,
+        "status": "ok",
+        "attempts": attempts,
+        "input_tokens": prompt_tokens,
+        "output_tokens": total_tokens,
+        "output_chunks": len(token_times),
+        "first_chunk_tokens": first_chunk_tokens,
+        "token_source": token_source,
+        "cache": cache,
+        "cache_source": cache_source,
+        "cached_tokens": cached_tokens,
+        "latency": elapsed_time,
+        "tokens_per_second": tokens_per_second,
+        "ttft": ttft,
+        "tpot": tpot,
+        "itl": itl,
+        "max_itl": itl.max() if len(itl) else None,
+        "chunk_gaps": chunk_gaps,
+        "token_times": token_times,
+        "scheduled_time": scheduled_time,
+        "send_time": start_time,
+        "first_token_time": first_token_time,
+        "last_token_time": last_token_time,
+        "end_time": end_time,
+    }
+
+async def worker(client, semaphore, task_ids, metrics, workload, request_timeout, tokenizer=None, event_log=None, retry_policy=None, prefix_gate=None):
+    # Workers share one task_ids iterator, so request ids are produced as
+    # they are needed instead of being queued up front
+    for task_id in task_ids:
         async with semaphore:
-            task_id = await queue.get()
-            if task_id is None:
-                queue.task_done()
-                break
-            logging.info(f"Starting request {task_id}")
-            result = await make_request(client, output_tokens, request_timeout, use_long_context)
-            if result:
-                results.append(result)
-            else:
-                logging.warning(f"Request {task_id} failed")
-            queue.task_done()
-            logging.info(f"Finished request {task_id}")
-
-def calculate_percentile(values, percentile, reverse=False):
-    if not values:
-        return None
-    if reverse:
-        return np.percentile(values, 100 - percentile)
-    return np.percentile(values, percentile)
-
-async def run_benchmark(num_requests, concurrency, request_timeout, output_tokens, vllm_url, api_key, use_long_context):
-    client = AsyncOpenAI(base_url=vllm_url, api_key=api_key)
+            logging.debug(f"Starting request {task_id}")
+            result = await make_request(client, workload, task_id, request_timeout, tokenizer=tokenizer, retry_policy=retry_policy, prefix_gate=prefix_gate)
+            metrics.record(result)
+            if event_log:
+                event_log.write(result)
+            logging.debug(f"Finished request {task_id}")
+
+async def scheduled_request(client, semaphore, task_id, scheduled_time, metrics, workload, request_timeout, tokenizer=None, event_log=None, retry_policy=None, prefix_gate=None):
+    async with semaphore:
+        logging.debug(f"Starting request {task_id}")
+        result = await make_request(client, workload, task_id, request_timeout, scheduled_time, tokenizer, retry_policy, prefix_gate)
+    metrics.record(result)
+    if event_log:
+        event_log.write(result)
+    logging.debug(f"Finished request {task_id}")
+
+async def dispatch_requests(client, semaphore, schedule, metrics, workload, request_timeout, tokenizer=None, event_log=None, retry_policy=None, prefix_gate=None):
+    # Open-loop dispatch: requests are fired on their own schedule and never
+    # wait for earlier requests to complete. Only in-flight tasks are kept.
+    tasks = set()
+    start_time = time.perf_counter()
+    for task_id, offset in schedule:
+        scheduled_time = start_time + offset
+        delay = scheduled_time - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(scheduled_request(client, semaphore, task_id, scheduled_time, metrics, workload, request_timeout, tokenizer, event_log, retry_policy, prefix_gate))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
+
+def generate_arrival_times(num_requests, qps, distribution="poisson", burstiness=1.0, seed=None, batch_size=4096):
+    # Yields arrival offsets in seconds; intervals are drawn in batches so
+    # memory use does not grow with num_requests
+    if distribution not in ("poisson", "gamma", "constant"):
+        raise ValueError(f"Unknown arrival distribution: {distribution}")
+    rng = np.random.default_rng(seed)
+    offset = 0.0
+    for start in range(0, num_requests, batch_size):
+        size = min(batch_size, num_requests - start)
+        if distribution == "constant":
+            intervals = np.full(size, 1.0 / qps)
+        elif distribution == "gamma":
+            # Shape < 1 gives burstier traffic than Poisson, shape > 1 smoother
+            intervals = rng.gamma(burstiness, 1.0 / (qps * burstiness), size)
+        else:
+            intervals = rng.exponential(1.0 / qps, size)
+        if start == 0:
+            intervals[0] = 0
+        for interval in intervals.tolist():
+            offset += interval
+            yield offset
+
+def load_arrival_trace(path, num_requests):
+    # Yields offsets from the first timestamp, reading the trace line by line
+    first = previous = None
+    count = 0
+    with open(path) as f:
+        for line in f:
+            if count >= num_requests:
+                return
+            if not line.strip():
+                continue
+            timestamp = float(line)
+            if first is None:
+                first = previous = timestamp
+            if timestamp < previous:
+                raise ValueError(f"Arrival trace {path} is not sorted")
+            previous = timestamp
+            count += 1
+            yield timestamp - first
+
+def count_arrival_trace(path, num_requests):
+    count = sum(1 for _ in load_arrival_trace(path, num_requests))
+    if not count:
+        raise ValueError(f"No timestamps found in arrival trace {path}")
+    return count
+
+class ArrivalSchedule:
+    # Picklable description of the open-loop schedule; iterating it yields
+    # (task_id, offset) for every request, generated lazily
+    def __init__(self, num_requests, qps=None, distribution="poisson", burstiness=1.0, seed=None, trace=None):
+        self.num_requests = num_requests
+        self.qps = qps
+        self.distribution = distribution
+        self.burstiness = burstiness
+        self.seed = seed
+        self.trace = trace
+
+    def __iter__(self):
+        if self.trace:
+            return enumerate(load_arrival_trace(self.trace, self.num_requests))
+        return enumerate(generate_arrival_times(self.num_requests, self.qps, self.distribution, self.burstiness, self.seed))
+
+def format_seconds(value):
+    return f"{value * 1000:.1f}ms" if value is not None else "n/a"
+
+def log_progress(window, elapsed, duration):
+    ttft = window.histograms["ttft"]
+    itl = window.histograms["itl"]
+    logging.info(f"Progress at {elapsed:.0f}s: {window.successful_requests} requests ({window.failed_requests} failed) in the last {duration:.0f}s, "
+                 f"TTFT p50 {format_seconds(ttft.percentile(50))} p99 {format_seconds(ttft.percentile(99))}, "
+                 f"ITL p50 {format_seconds(itl.percentile(50))} p99 {format_seconds(itl.percentile(99))}")
+
+async def report_progress(metrics, interval, send_window=None):
+    # Periodically log percentiles over the most recent window of requests.
+    # A shard instead hands each window to send_window, and the coordinating
+    # process logs it merged with the other shards' windows.
+    start_time = window_start = time.perf_counter()
+    index = 0
+    while True:
+        await asyncio.sleep(interval)
+        now = time.perf_counter()
+        window = metrics.take_window()
+        if send_window is None:
+            log_progress(window, now - start_time, now - window_start)
+        else:
+            send_window(index, now - start_time, now - window_start, window)
+        window_start = now
+        index += 1
+
+async def merge_progress(progress_queue, num_processes):
+    # Shards send (shard, index, elapsed, duration, window) every interval and
+    # (shard, None, None, None, None) when they finish. An interval is logged
+    # once every shard still running has sent its window for it.
+    loop = asyncio.get_running_loop()
+    windows = {}
+    reported = [0] * num_processes
+    running = set(range(num_processes))
+    next_index = 0
+    while running:
+        shard, index, elapsed, duration, window = await loop.run_in_executor(None, progress_queue.get)
+        if index is None:
+            running.discard(shard)
+        else:
+            reported[shard] = index + 1
+            windows.setdefault(index, []).append((elapsed, duration, window))
+        while next_index in windows and all(reported[s] > next_index for s in running):
+            parts = windows.pop(next_index)
+            merged = parts[0][2]
+            for _, _, window in parts[1:]:
+                merged.merge(window)
+            log_progress(merged, max(part[0] for part in parts), max(part[1] for part in parts))
+            next_index += 1
+
+def create_client(transport, vllm_url, api_key):
+    if transport == "http":
+        return SSEClient(vllm_url, api_key)
+    # Retries are handled by make_request so that every attempt is counted
+    return AsyncOpenAI(base_url=vllm_url, api_key=api_key, max_retries=0)
+
+SAMPLE_CHUNK = b'data: {"id":"cmpl-0","object":"chat.completion.chunk","created":0,"model":"NousResearch/Meta-Llama-3.1-8B-Instruct","choices":[{"index":0,"delta":{"content":" token"},"logprobs":null,"finish_reason":null}]}\n\n'
+FINAL_CHUNK = b'data: {"id":"cmpl-0","object":"chat.completion.chunk","created":0,"model":"NousResearch/Meta-Llama-3.1-8B-Instruct","choices":[{"index":0,"delta":{"content":" token"},"logprobs":null,"finish_reason":"length"}]}\n\ndata: [DONE]\n\n'
+
+async def calibrate_client_overhead(transport, num_chunks=10000):
+    # Client time from receiving a streamed chunk to yielding its content.
+    # A local server sends a synthetic SSE body in a single write, so every
+    # chunk is already buffered and the gaps between yielded chunks are the
+    # transport's own decoding path (HTTP read, SSE parsing, chunk objects).
+    body = SAMPLE_CHUNK * (num_chunks - 1) + FINAL_CHUNK
+    response = b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nContent-Length: %d\r\n\r\n" % len(body) + body
+
+    async def handle(reader, writer):
+        headers = await reader.readuntil(b"\r\n\r\n")
+        length = next((int(line.split(b":", 1)[1]) for line in headers.split(b"\r\n") if line.lower().startswith(b"content-length:")), 0)
+        await reader.readexactly(length)
+        writer.write(response)
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    client = create_client(transport, f"http://127.0.0.1:{port}/v1", "calibration")
+    payload = {"model": "NousResearch/Meta-Llama-3.1-8B-Instruct", "messages": [{"role": "user", "content": "calibration"}], "max_tokens": num_chunks}
+    token_times = array('d')
+    try:
+        if isinstance(client, SSEClient):
+            await client.stream_chat(payload, token_times)
+        else:
+            await stream_openai(client, payload, token_times)
+    finally:
+        await client.close()
+        server.close()
+        await server.wait_closed()
+    return (token_times[-1] - token_times[0]) / (len(token_times) - 1)
+
+# Seconds a shard waits for the other shards to start before giving up
+SHARD_START_TIMEOUT = 120
+
+async def generate_load(num_requests, schedule, concurrency, request_timeout, workload, vllm_url, api_key, stall_threshold, tokenizer_path, report_interval, transport="openai", event_log_dir=None, retry_policy=None, goodput_slos=None, shard=0, num_processes=1, start_barrier=None, progress_queue=None):
+    try:
+        client = create_client(transport, vllm_url, api_key)
+        tokenizer = load_tokenizer(tokenizer_path) if tokenizer_path else None
+    except Exception:
+        # Break the barrier so the other shards fail instead of waiting
+        if start_barrier is not None:
+            start_barrier.abort()
+        raise
     semaphore = asyncio.Semaphore(concurrency)
-    queue = asyncio.Queue()
-    results = []
-
-    # Add tasks to the queue
-    for i in range(num_requests):
-        await queue.put(i)
-    
-    # Add sentinel values to stop workers
-    for _ in range(concurrency):
-        await queue.put(None)
-
-    # Create worker tasks
-    workers = [asyncio.create_task(worker(client, semaphore, queue, results, output_tokens, request_timeout, use_long_context)) for _ in range(concurrency)]
-
-    start_time = time.time()
-    
-    # Wait for all tasks to complete
-    await queue.join()
-    await asyncio.gather(*workers)
-
-    end_time = time.time()
-
-    # Calculate metrics
-    total_elapsed_time = end_time - start_time
-    total_tokens = sum(tokens for tokens, _, _, _ in results if tokens is not None)
-    latencies = [elapsed_time for _, elapsed_time, _, _ in results if elapsed_time is not None]
-    tokens_per_second_list = [tps for _, _, tps, _ in results if tps is not None]
-    ttft_list = [ttft for _, _, _, ttft in results if ttft is not None]
-
-    successful_requests = len(results)
-    requests_per_second = successful_requests / total_elapsed_time if total_elapsed_time > 0 else 0
-    avg_latency = sum(latencies) / len(latencies) if latencies else 0
-    avg_tokens_per_second = sum(tokens_per_second_list) / len(tokens_per_second_list) if tokens_per_second_list else 0
-    avg_ttft = sum(ttft_list) / len(ttft_list) if ttft_list else 0
-    
-    # Calculate percentiles
-    percentiles = [50, 95, 99]
-    latency_percentiles = [calculate_percentile(latencies, p) for p in percentiles]
-    tps_percentiles = [calculate_percentile(tokens_per_second_list, p, reverse=True) for p in percentiles]
-    ttft_percentiles = [calculate_percentile(ttft_list, p) for p in percentiles]
-    
-    return {
+    metrics = MetricsAggregator(stall_threshold, goodput_slos)
+    event_log = EventLogWriter(event_log_dir, shard) if event_log_dir else None
+
+    if start_barrier is not None:
+        # Wait until every shard is ready so they all start sending together.
+        # A shard that dies before reaching the barrier makes the others
+        # raise BrokenBarrierError after the timeout.
+        await asyncio.get_running_loop().run_in_executor(None, start_barrier.wait, SHARD_START_TIMEOUT)
+
+    start_time = time.perf_counter()
+    if event_log:
+        event_log.start_time = start_time
+    reporter = None
+    # Progress windows are pickled and sent to the coordinator from one
+    # background thread, in order, so the event loop is not blocked
+    progress_sender = ThreadPoolExecutor(1) if progress_queue is not None else None
+    if report_interval:
+        metrics.start_window()
+        send_window = (lambda *message: progress_sender.submit(progress_queue.put, (shard, *message))) if progress_sender else None
+        reporter = asyncio.create_task(report_progress(metrics, report_interval, send_window))
+
+    # This shard's requests are an interleaved slice of all task ids. Prefix
+    # groups are kept whole so that a group's requests can wait on each other.
+    group_size = workload.prefix_group_size if workload.prefix_mode else 1
+    prefix_gate = PrefixGate(workload, num_requests) if group_size > 1 else None
+    if schedule is None:
+        task_ids = (task_id for task_id in range(num_requests) if task_id // group_size % num_processes == shard)
+
+        # Create worker tasks
+        workers = [asyncio.create_task(worker(client, semaphore, task_ids, metrics, workload, request_timeout, tokenizer, event_log, retry_policy, prefix_gate)) for _ in range(concurrency)]
+
+        # Wait for all tasks to complete
+        await asyncio.gather(*workers)
+    else:
+        shard_schedule = ((task_id, offset) for task_id, offset in schedule if task_id // group_size % num_processes == shard)
+        await dispatch_requests(client, semaphore, shard_schedule, metrics, workload, request_timeout, tokenizer, event_log, retry_policy, prefix_gate)
+
+    end_time = time.perf_counter()
+    if reporter:
+        reporter.cancel()
+    if progress_sender:
+        progress_sender.submit(progress_queue.put, (shard, None, None, None, None))
+        progress_sender.shutdown()
+    await client.close()
+    if event_log:
+        event_log.close()
+    metrics.window = None
+    return metrics, end_time - start_time
+
+def run_shard(*args):
+    return asyncio.run(generate_load(*args))
+
+async def run_sharded(num_processes, num_requests, schedule, concurrency, *load_args):
+    # Each shard gets an interleaved slice of the requests (and so of the
+    # arrival schedule, which every shard generates for itself) and its share
+    # of the concurrency, and runs its own event loop and client in a
+    # separate process
+    context = multiprocessing.get_context("spawn")
+    loop = asyncio.get_running_loop()
+    with context.Manager() as manager, ProcessPoolExecutor(num_processes, mp_context=context) as executor:
+        start_barrier = manager.Barrier(num_processes)
+        # Shards send their progress windows here to be logged as one
+        progress_queue = manager.Queue()
+        merger = asyncio.create_task(merge_progress(progress_queue, num_processes))
+        shards = []
+        for shard in range(num_processes):
+            shard_concurrency = concurrency // num_processes + (1 if shard < concurrency % num_processes else 0)
+            shards.append(loop.run_in_executor(executor, run_shard, num_requests, schedule, shard_concurrency, *load_args, shard, num_processes, start_barrier, progress_queue))
+        shard_results = await asyncio.gather(*shards, return_exceptions=True)
+        # A shard that failed never sent its finish message
+        for shard in range(num_processes):
+            progress_queue.put((shard, None, None, None, None))
+        await merger
+
+    errors = [result for result in shard_results if isinstance(result, BaseException)]
+    if errors:
+        # Report the error that stopped a shard rather than the broken
+        # barrier it left the other shards with
+        raise next((e for e in errors if not isinstance(e, threading.BrokenBarrierError)), errors[0])
+
+    metrics, total_elapsed_time = shard_results[0]
+    for shard_metrics, shard_elapsed_time in shard_results[1:]:
+        metrics.merge(shard_metrics)
+        total_elapsed_time = max(total_elapsed_time, shard_elapsed_time)
+    return metrics, total_elapsed_time
+
+async def run_benchmark(num_requests, concurrency, request_timeout, output_tokens, vllm_url, api_key, use_long_context, qps=None, arrival_distribution="poisson", burstiness=1.0, arrival_trace=None, stall_threshold=0.5, tokenizer_path=None, report_interval=10, num_processes=1, transport="openai", calibrate=False, dataset=None, input_length_distribution=None, output_length_distribution=None, seed=None, prefix_mode=None, prefix_length=256, prefix_reuse_ratio=0.9, event_log=None, max_retries=0, retry_backoff=0.5, goodput_ttft_slo=None, goodput_itl_slo=None):
+    if num_processes > concurrency:
+        # Every shard needs at least one concurrent request
+        raise ValueError(f"num_processes ({num_processes}) cannot exceed concurrency ({concurrency})")
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+
+    if arrival_trace:
+        num_requests = count_arrival_trace(arrival_trace, num_requests)
+        schedule = ArrivalSchedule(num_requests, trace=arrival_trace)
+    elif qps:
+        schedule = ArrivalSchedule(num_requests, qps, arrival_distribution, burstiness, seed)
+    else:
+        schedule = None
+
+    output_lengths = LengthDistribution(output_length_distribution) if output_length_distribution else None
+    if dataset:
+        records = sample_dataset(dataset, num_requests, random.Random(seed))
+    elif input_length_distribution or prefix_mode == "multi_turn":
+        records = None
+    else:
+        records = builtin_records(use_long_context)
+    input_lengths = LengthDistribution(input_length_distribution) if input_length_distribution else None
+    workload = Workload(records, output_tokens, input_lengths, output_lengths, seed, prefix_mode, prefix_length, prefix_reuse_ratio)
+
+    config = {
         "total_requests": num_requests,
-        "successful_requests": successful_requests,
         "concurrency": concurrency,
         "request_timeout": request_timeout,
         "max_output_tokens": output_tokens,
         "use_long_context": use_long_context,
+        "dataset": dataset,
+        "input_length_distribution": input_length_distribution,
+        "output_length_distribution": output_length_distribution,
+        "seed": workload.seed,
+        "prefix_mode": prefix_mode,
+        "prefix_length": prefix_length if prefix_mode else None,
+        "prefix_reuse_ratio": prefix_reuse_ratio if prefix_mode else None,
+        "arrival_mode": "closed_loop" if schedule is None else ("trace" if arrival_trace else arrival_distribution),
+        "target_qps": qps if schedule is not None and not arrival_trace else None,
+        "num_processes": num_processes,
+        "transport": transport,
+        "max_retries": max_retries,
+    }
+    if event_log:
+        write_metadata(event_log, config)
+
+    retry_policy = RetryPolicy(max_retries, retry_backoff) if max_retries else None
+    # Per-request goodput SLOs; the ITL SLO applies to the request's average
+    # inter-token latency (time per output token)
+    goodput_slos = {name: slo for name, slo in [("ttft", goodput_ttft_slo), ("tpot", goodput_itl_slo)] if slo is not None} or None
+
+    load_args = (request_timeout, workload, vllm_url, api_key, stall_threshold, tokenizer_path, report_interval, transport, event_log, retry_policy, goodput_slos)
+    if num_processes > 1:
+        metrics, total_elapsed_time = await run_sharded(num_processes, num_requests, schedule, concurrency, *load_args)
+    else:
+        metrics, total_elapsed_time = await generate_load(num_requests, schedule, concurrency, *load_args)
+
+    return {
+        **config,
+        "client_overhead_per_chunk": await calibrate_client_overhead(transport) if calibrate else None,
         "total_time": total_elapsed_time,
-        "requests_per_second": requests_per_second,
-        "total_output_tokens": total_tokens,
-        "latency": {
-            "average": avg_latency,
-            "p50": latency_percentiles[0],
-            "p95": latency_percentiles[1],
-            "p99": latency_percentiles[2]
-        },
-        "tokens_per_second": {
-            "average": avg_tokens_per_second,
-            "p50": tps_percentiles[0],
-            "p95": tps_percentiles[1],
-            "p99": tps_percentiles[2]
-        },
-        "time_to_first_token": {
-            "average": avg_ttft,
-            "p50": ttft_percentiles[0],
-            "p95": ttft_percentiles[1],
-            "p99": ttft_percentiles[2]
-        }
+        **metrics.summary(total_elapsed_time)
     }
 
 def print_results(results):
@@ -259,9 +755,31 @@ if __name__ == "__main__":
     parser.add_argument("--vllm_url", type=str, required=True, help="URL of the vLLM server")
     parser.add_argument("--api_key", type=str, required=True, help="API key for vLLM server")
     parser.add_argument("--use_long_context", action="store_true", help="Use long context prompt pairs instead of short prompts")
+    parser.add_argument("--dataset", type=str, default=None, help="JSONL or ShareGPT-style JSON file to sample prompts and output lengths from")
+    parser.add_argument("--input_length_distribution", type=str, default=None, help="Synthetic prompt length in tokens, e.g. fixed:512, uniform:100:1000, normal:500:100, lognormal:400:0.8")
+    parser.add_argument("--output_length_distribution", type=str, default=None, help="Output length in tokens, same format as --input_length_distribution (overrides --output_tokens and dataset lengths)")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for prompt sampling and arrival times")
+    parser.add_argument("--prefix_mode", type=str, default=None, choices=["shared", "multi_turn"], help="Generate prompts with reusable prefixes: a shared system prompt/document, or growing multi-turn conversations")
+    parser.add_argument("--prefix_length", type=int, default=256, help="Tokens in the shared prefix, or per conversation turn in multi_turn mode (default: 256)")
+    parser.add_argument("--prefix_reuse_ratio", type=float, default=0.9, help="Fraction of requests that reuse an earlier prefix (default: 0.9)")
+    parser.add_argument("--qps", type=float, default=None, help="Target requests per second for open-loop arrivals (default: closed-loop)")
+    parser.add_argument("--arrival_distribution", type=str, default="poisson", choices=["poisson", "gamma", "constant"], help="Inter-arrival distribution for open-loop mode (default: poisson)")
+    parser.add_argument("--burstiness", type=float, default=1.0, help="Gamma shape parameter, values below 1 are burstier (default: 1.0)")
+    parser.add_argument("--arrival_trace", type=str, default=None, help="File with one arrival timestamp in seconds per line to replay")
+    parser.add_argument("--tokenizer", type=str, default=None, help="Path to a tokenizer.json used to count tokens when the server does not report usage")
+    parser.add_argument("--stall_threshold", type=float, default=0.5, help="Inter-token gap in seconds counted as a decode stall (default: 0.5)")
+    parser.add_argument("--num_processes", type=int, default=1, help="Number of load generator processes to shard requests across (default: 1)")
+    parser.add_argument("--transport", type=str, default="openai", choices=["openai", "http"], help="Client used to send requests: the openai SDK or a lightweight aiohttp SSE client (default: openai)")
+    parser.add_argument("--calibrate", action="store_true", help="Measure the client's receive-to-yield time per streamed chunk and include it in the results")
+    parser.add_argument("--event_log", type=str, default=None, help="Directory to write a per-request event log to, for analyze_events.py")
+    parser.add_argument("--max_retries", type=int, default=0, help="Retries for requests failing with HTTP 429/5xx or a dropped connection (default: 0)")
+    parser.add_argument("--retry_backoff", type=float, default=0.5, help="Delay before the first retry in seconds, doubled for each further retry (default: 0.5)")
+    parser.add_argument("--goodput_ttft_slo", type=float, default=None, help="Time to first token in seconds a request must meet to count towards goodput")
+    parser.add_argument("--goodput_itl_slo", type=float, default=None, help="Average inter-token latency in seconds a request must meet to count towards goodput")
+    parser.add_argument("--report_interval", type=float, default=10, help="Seconds between rolling-window progress reports, 0 to disable (default: 10)")
     args = parser.parse_args()
 
-    results = asyncio.run(run_benchmark(args.num_requests, args.concurrency, args.request_timeout, args.output_tokens, args.vllm_url, args.api_key, args.use_long_context))
+    results = asyncio.run(run_benchmark(args.num_requests, args.concurrency, args.request_timeout, args.output_tokens, args.vllm_url, args.api_key, args.use_long_context, args.qps, args.arrival_distribution, args.burstiness, args.arrival_trace, args.stall_threshold, args.tokenizer, args.report_interval, args.num_processes, args.transport, args.calibrate, args.dataset, args.input_length_distribution, args.output_length_distribution, args.seed, args.prefix_mode, args.prefix_length, args.prefix_reuse_ratio, args.event_log, args.max_retries, args.retry_backoff, args.goodput_ttft_slo, args.goodput_itl_slo))
     print_results(results)
 else:
     # When imported as a module, provide the run_benchmark function
@@ -0,0 +1,188 @@
+import json
+import math
+import random
+import re
+
+# Common short English words; each is roughly one token for most tokenizers
+FILLER_WORDS = [
+    "the", "of", "and", "to", "in", "is", "that", "for", "it", "as", "was", "with", "be", "by", "on", "not",
+    "he", "this", "are", "or", "his", "from", "at", "which", "but", "have", "an", "had", "they", "you", "were",
+    "their", "one", "all", "we", "can", "her", "has", "there", "been", "if", "more", "when", "will", "would",
+    "who", "so", "no", "time", "people", "water", "world", "system", "data", "model", "light", "energy",
+]
+
+WHITESPACE = re.compile(r"[\s,]*")
+
+def iter_json_array(path, chunk_size=1 << 20):
+    # Decode the elements of a top-level JSON array one at a time, reading the
+    # file in chunks instead of loading it whole
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"Expected a JSON array in {path}")
+        pos = 1
+        while True:
+            pos = WHITESPACE.match(buffer, pos).end()
+            if buffer.startswith("]", pos):
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                more = f.read(chunk_size)
+                if not more:
+                    raise
+                buffer = buffer[pos:] + more
+                pos = 0
+                continue
+            yield record
+            pos = end
+
+def iter_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def iter_dataset(path):
+    with open(path, encoding="utf-8") as f:
+        first = f.read(1024).lstrip()[:1]
+    return iter_json_array(path) if first == "[" else iter_jsonl(path)
+
+def normalize_record(record):
+    # Accepts {"prompt": ...}, {"messages": [...]} and ShareGPT-style
+    # {"conversations": [{"from": "human", ...}, {"from": "gpt", ...}]}
+    if "conversations" in record:
+        turns = record["conversations"]
+        human = next((i for i, turn in enumerate(turns) if turn.get("from") in ("human", "user")), None)
+        if human is None:
+            return None
+        reply = turns[human + 1] if human + 1 < len(turns) else None
+        output_tokens = None
+        if reply is not None and reply.get("from") in ("gpt", "assistant"):
+            # Without a tokenizer, estimate about four characters per token
+            output_tokens = max(1, len(reply["value"]) // 4)
+        return {"messages": [{"role": "user", "content": turns[human]["value"]}], "output_tokens": output_tokens}
+    if "messages" in record:
+        messages = record["messages"]
+    elif "prompt" in record:
+        messages = [{"role": "user", "content": record["prompt"]}]
+    else:
+        return None
+    return {"messages": messages, "output_tokens": record.get("output_tokens", record.get("max_tokens"))}
+
+def sample_dataset(path, num_records, rng):
+    # Reservoir sampling: one pass over the file, keeping at most num_records
+    sample = []
+    seen = 0
+    for index, record in enumerate(iter_dataset(path)):
+        record = normalize_record(record)
+        if record is None:
+            continue
+        record["prompt_id"] = index
+        if len(sample) < num_records:
+            sample.append(record)
+        else:
+            slot = rng.randint(0, seen)
+            if slot < num_records:
+                sample[slot] = record
+        seen += 1
+    if not sample:
+        raise ValueError(f"No usable prompts found in {path}")
+    # The reservoir keeps records in file order until it fills up, so shuffle
+    # it once; requests then take records in turn without repeating any
+    rng.shuffle(sample)
+    return sample
+
+class Distribution:
+    # Parsed from "fixed:X", "uniform:MIN:MAX", "normal:MEAN:STD" or
+    # "lognormal:MEDIAN:SIGMA"; calling it draws a non-negative value
+    PARAMS = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+
+    def __init__(self, spec):
+        name, *params = spec.split(":")
+        if self.PARAMS.get(name) != len(params):
+            raise ValueError(f"Invalid distribution: {spec}")
+        self.spec = spec
+        self.name = name
+        self.params = [float(p) for p in params]
+
+    def __call__(self, rng):
+        if self.name == "fixed":
+            value = self.params[0]
+        elif self.name == "uniform":
+            value = rng.uniform(*self.params)
+        elif self.name == "normal":
+            value = rng.gauss(*self.params)
+        else:
+            value = rng.lognormvariate(math.log(self.params[0]), self.params[1])
+        return max(0.0, value)
+
+class LengthDistribution(Distribution):
+    # Token counts: rounded, and at least 1
+    def __call__(self, rng):
+        return max(1, int(round(super().__call__(rng))))
+
+def synthetic_prompt(num_tokens, rng):
+    return " ".join(rng.choice(FILLER_WORDS) for _ in range(num_tokens))
+
+class Workload:
+    # Produces the prompt and output length for each request. Request N uses
+    # record N (cycling when there are fewer records than requests) and draws
+    # everything else from its own generator seeded with (seed, task_id), so a
+    # run is reproducible regardless of completion order or how it is sharded.
+    def __init__(self, records=None, output_tokens=50, input_lengths=None, output_lengths=None, seed=None, prefix_mode=None, prefix_length=0, prefix_reuse_ratio=0.0):
+        self.records = records
+        self.output_tokens = output_tokens
+        self.input_lengths = input_lengths
+        self.output_lengths = output_lengths
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.prefix_mode = prefix_mode
+        self.prefix_length = prefix_length
+        if not 0 <= prefix_reuse_ratio < 1:
+            raise ValueError("prefix_reuse_ratio must be in [0, 1)")
+        # Consecutive requests that share one prefix; all but the first of
+        # each group are expected to hit the prefix cache
+        self.prefix_group_size = max(1, round(1 / (1 - prefix_reuse_ratio)))
+
+    def prefix_group(self, task_id):
+        # (group, position in group) of a request in prefix mode
+        return divmod(task_id, self.prefix_group_size)
+
+    def get(self, task_id):
+        # Returns (messages, max_tokens, prompt_id, expected_cache), where
+        # expected_cache is "hit", "miss" or None outside prefix mode
+        rng = random.Random(f"{self.seed}-{task_id}")
+        output_tokens = self.output_tokens
+        if self.prefix_mode == "multi_turn":
+            # The conversation generated below replaces the prompt entirely
+            messages, prompt_id = None, None
+        elif self.records:
+            record = self.records[task_id % len(self.records)]
+            messages = record["messages"]
+            output_tokens = record["output_tokens"] or self.output_tokens
+            prompt_id = record["prompt_id"]
+        else:
+            messages = [{"role": "user", "content": synthetic_prompt(self.input_lengths(rng), rng)}]
+            prompt_id = f"synthetic-{task_id}"
+        if self.output_lengths:
+            output_tokens = self.output_lengths(rng)
+
+        expected_cache = None
+        if self.prefix_mode:
+            group, position = self.prefix_group(task_id)
+            prefix_rng = random.Random(f"{self.seed}-prefix-{group}")
+            if self.prefix_mode == "shared":
+                # A system prompt or document shared by every request in the group
+                messages = [{"role": "system", "content": synthetic_prompt(self.prefix_length, prefix_rng)}] + messages
+            else:
+                # Turn N of a conversation repeats turns 0..N-1 verbatim, so the
+                # whole previous prompt is a cacheable prefix
+                messages = []
+                for _ in range(position):
+                    messages.append({"role": "user", "content": synthetic_prompt(self.prefix_length, prefix_rng)})
+                    messages.append({"role": "assistant", "content": synthetic_prompt(self.prefix_length, prefix_rng)})
+                messages.append({"role": "user", "content": synthetic_prompt(self.prefix_length, prefix_rng)})
+                prompt_id = f"conversation-{group}-turn-{position}"
+            expected_cache = "miss" if position == 0 else "hit"
+        return messages, output_tokens, prompt_id, expected_cache